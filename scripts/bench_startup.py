@@ -0,0 +1,72 @@
+"""
+Description: 测量GUI启动耗时（模块导入 / 首次绘制 / 显示第一个学生），超过阈值时返回非零退出码，
+             用于发现启动速度的回退。默认使用offscreen平台，无需显示器。
+
+用法:
+    python3 scripts/bench_startup.py --config /extp6/ai_ta/hw8/configs/hw1.yaml --repeat 5
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+gui_path = os.path.join(os.path.dirname(current_dir), 'src', 'gui.py')
+
+STAGES = ["imports", "first paint", "first student"]
+TIMING_RE = re.compile(r"^\[startup\] (.+): ([0-9.]+)s$")
+
+
+def run_once(config_path):
+    """启动一次GUI并解析stderr中的计时信息"""
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    proc = subprocess.run(
+        [sys.executable, gui_path, "--config", config_path, "--profile-startup", "--exit-after-load"],
+        env=env, capture_output=True, text=True, timeout=300,
+    )
+    timings = {}
+    for line in proc.stderr.splitlines():
+        match = TIMING_RE.match(line.strip())
+        if match:
+            timings[match.group(1)] = float(match.group(2))
+    if proc.returncode != 0 or any(stage not in timings for stage in STAGES):
+        print(proc.stderr, file=sys.stderr)
+        raise RuntimeError(f"gui.py exited with code {proc.returncode} before reporting all startup stages")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GUI startup time')
+    parser.add_argument('--config', help='Path to config file', required=True)
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the median is reported')
+    parser.add_argument('--max-imports', type=float, default=1.0, help='Threshold (s) for module imports')
+    parser.add_argument('--max-first-paint', type=float, default=2.0, help='Threshold (s) for the first window paint')
+    parser.add_argument('--max-first-student', type=float, default=None, help='Threshold (s) for showing the first student')
+    args = parser.parse_args()
+
+    runs = [run_once(args.config) for _ in range(args.repeat)]
+    thresholds = {
+        "imports": args.max_imports,
+        "first paint": args.max_first_paint,
+        "first student": args.max_first_student,
+    }
+
+    failed = False
+    for stage in STAGES:
+        median = statistics.median(run[stage] for run in runs)
+        limit = thresholds[stage]
+        status = ""
+        if limit is not None and median > limit:
+            status = f"  REGRESSION (> {limit:.3f}s)"
+            failed = True
+        print(f"{stage:>14}: {median:.3f}s{status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
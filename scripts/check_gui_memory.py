@@ -0,0 +1,120 @@
+"""
+Description: GUI内存回归检查。在offscreen平台下生成一批带图片输出的合成notebook，
+             反复切换学生数千次，若常驻内存(RSS)增长超过阈值则返回非零退出码。
+
+用法:
+    python3 scripts/check_gui_memory.py --students 50 --iterations 3000 --max-growth-mb 40
+"""
+
+import os
+import sys
+import json
+import base64
+import argparse
+import tempfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(current_dir), 'src'))
+
+import yaml
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImage, QColor
+from PyQt5.QtWidgets import QApplication
+
+from gui import GradingApp
+
+TARGET = "#    Memory Check        #"
+
+
+def current_rss_mb():
+    """当前进程的常驻内存(MB)"""
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def make_png(seed):
+    image = QImage(800, 600, QImage.Format_RGB32)
+    image.fill(QColor((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    return base64.b64encode(bytes(data)).decode("ascii")
+
+
+def write_fixtures(root, num_students):
+    hw_dir = os.path.join(root, "student_summit")
+    output_dir = os.path.join(root, "output")
+    os.makedirs(hw_dir)
+    for i in range(num_students):
+        notebook = {
+            "nbformat": 4,
+            "nbformat_minor": 5,
+            "metadata": {},
+            "cells": [{
+                "cell_type": "code",
+                "id": f"cell-{i}",
+                "execution_count": 1,
+                "metadata": {},
+                "source": f"{TARGET}\nprint('student {i}')\n",
+                "outputs": [
+                    {"output_type": "stream", "name": "stdout", "text": f"student {i}\n" * 200},
+                    {"output_type": "display_data", "metadata": {}, "data": {"image/png": make_png(i)}},
+                ],
+            }],
+        }
+        with open(os.path.join(hw_dir, f"学生{i}-{2230000 + i}.ipynb"), "w", encoding="utf-8") as f:
+            json.dump(notebook, f)
+
+    config_path = os.path.join(root, "check.yaml")
+    with open(config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump({
+            "hw_path": hw_dir,
+            "outputs_path": output_dir,
+            "output_id": "memcheck",
+            "target": TARGET,
+        }, f, allow_unicode=True)
+    return config_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that GUI memory stays flat while navigating')
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=3000)
+    parser.add_argument('--warmup', type=int, default=200, help='Navigations before the baseline RSS sample')
+    parser.add_argument('--max-growth-mb', type=float, default=40.0)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as root:
+        config_path = write_fixtures(root, args.students)
+        grading_app = GradingApp(config_path=config_path)
+        grading_app.show()
+        while not grading_app.startup_complete:
+            app.processEvents()
+
+        def navigate(step):
+            grading_app.load_notebook_by_index(step % args.students)
+            app.processEvents()
+
+        for step in range(args.warmup):
+            navigate(step)
+        baseline = current_rss_mb()
+        for step in range(args.warmup, args.warmup + args.iterations):
+            navigate(step)
+        final = current_rss_mb()
+
+        grading_app.close()
+
+    growth = final - baseline
+    print(f"RSS baseline: {baseline:.1f}MB, after {args.iterations} navigations: {final:.1f}MB, growth: {growth:.1f}MB")
+    if growth > args.max_growth_mb:
+        print(f"REGRESSION: memory grew more than {args.max_growth_mb:.1f}MB")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
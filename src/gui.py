@@ -8,19 +8,135 @@ Description: CV Grading System with PyQt5 UI.
 Copyright (c) 2025 by ning-zelin zl.ning@qq.com, All Rights Reserved. 
 """
 
+import time
+_IMPORT_T0 = time.perf_counter()
 import os
 import sys
-import pandas as pd
+import socket
+import getpass
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QLabel, QPushButton, QLineEdit, QFileDialog, QTextBrowser, QSizePolicy)
-import nbformat
+# pandas / nbformat / openai 导入较慢，统一推迟到首次使用时（或后台线程中）再导入
 # from nbconvert import HTMLExporter # Not strictly needed for current output extraction
 import base64
+import json
 import yaml 
-from PyQt5.QtCore import Qt, QTimer
+from collections import OrderedDict
+from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal
+from score_store import ScoreStore, LeaseLostError, SCORE_COLUMNS, shard_of
+from prompt_builder import build_prompt, estimate_tokens
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_T0
+
+
+def read_existing_scores(output_file):
+    """读取已有评分文件，返回 (DataFrame, 错误信息)"""
+    import pandas as pd
+    try:
+        if os.path.exists(output_file):
+            scores_df = pd.read_excel(output_file, dtype={"学号": str})
+            # Ensure required columns exist
+            for col in SCORE_COLUMNS:
+                if col not in scores_df.columns:
+                    scores_df[col] = "" # Add missing columns as empty strings or appropriate defaults
+        else:
+            scores_df = pd.DataFrame(columns=SCORE_COLUMNS)
+        return scores_df, None
+    except Exception as e:
+        return pd.DataFrame(columns=SCORE_COLUMNS), e
+
+
+def scan_notebook_files(hw_dir, progress=None):
+    """逐条扫描作业目录，返回排序后的notebook路径列表；目录不存在时返回None"""
+    if not os.path.isdir(hw_dir):
+        return None
+    files = []
+    with os.scandir(hw_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".ipynb") and not entry.name.startswith('.~lock.'): # Ignore lock files
+                files.append(entry.path)
+                if progress is not None and len(files) % 100 == 0:
+                    progress(len(files))
+    return sorted(files) # Sort for consistent order
+
+
+def scores_df_to_rows(scores_df):
+    """DataFrame -> [(学号, 姓名, 分数, 评论)]，空值转为None"""
+    import pandas as pd
+    return [
+        tuple(None if pd.isna(value) else str(value) for value in row)
+        for row in scores_df[SCORE_COLUMNS].itertuples(index=False)
+    ]
+
+
+class ScoreLoader(QThread):
+    """后台初始化共享评分库并读取已有评分（含pandas导入），避免阻塞窗口显示"""
+    scores_ready = pyqtSignal(object, int, object)
+
+    def __init__(self, store, output_file, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.output_file = output_file
+
+    def run(self):
+        import pandas as pd
+        try:
+            self.store.init_db()
+            # 首次使用共享存储时，把已有的xlsx评分迁移进来
+            if self.store.is_empty() and os.path.exists(self.output_file):
+                legacy_df, error = read_existing_scores(self.output_file)
+                if error is not None:
+                    raise error
+                self.store.import_rows(scores_df_to_rows(legacy_df))
+            rows, rev = self.store.fetch_scores()
+            self.scores_ready.emit(pd.DataFrame(rows, columns=SCORE_COLUMNS), rev, None)
+        except Exception as e:
+            self.scores_ready.emit(pd.DataFrame(columns=SCORE_COLUMNS), 0, e)
+
+
+class NotebookScanner(QThread):
+    """后台扫描作业目录，扫描过程中持续汇报进度"""
+    progress = pyqtSignal(int)
+    files_ready = pyqtSignal(object)
+
+    def __init__(self, hw_dir, parent=None):
+        super().__init__(parent)
+        self.hw_dir = hw_dir
+
+    def run(self):
+        try:
+            files = scan_notebook_files(self.hw_dir, self.progress.emit)
+        except OSError:
+            files = None
+        # 顺便预热nbformat，首次加载notebook时无需再等待导入
+        try:
+            import nbformat  # noqa: F401
+        except ImportError:
+            pass
+        self.files_ready.emit(files)
+
+
+class XlsxExporter(QThread):
+    """后台把共享评分库导出为xlsx，保存时不阻塞界面"""
+    export_failed = pyqtSignal(str)
+
+    def __init__(self, store, output_file, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.output_file = output_file
+
+    def run(self):
+        try:
+            self.store.export_xlsx(self.output_file)
+        except Exception as e:
+            self.export_failed.emit(str(e))
+
+
 class GradingApp(QMainWindow):
-    def __init__(self, config_path=None):
+    def __init__(self, config_path=None, profile_startup=False, exit_after_load=False, grader=None, shard=None):
         super().__init__()
+        self.profile_startup = profile_startup
+        self.exit_after_load = exit_after_load
+        self._first_paint_done = False
         # 如果通过命令行指定了config_path，则使用它，否则使用默认路径
         self.config_file_path = config_path
         
@@ -36,8 +152,20 @@ class GradingApp(QMainWindow):
             self.hw_dir = self.config.get("hw_path")
             output_id = self.config.get("output_id")
             self.output_file = os.path.join(self.output_dir, f"评分结果_{str(output_id)}.xlsx")
+            self.ai_log_file = os.path.join(self.output_dir, f"ai_requests_{str(output_id)}.jsonl")
             
             os.makedirs(self.output_dir, exist_ok=True)
+
+            # 多位助教共享同一个评分库，按学生逐条写入并通过租约避免同时批改同一学生。
+            # grader只是显示/记录用的名字，租约按GUI实例区分，共用账号时也互不干扰
+            self.grader = grader or self.config.get("grader") or f"{getpass.getuser()}@{socket.gethostname()}"
+            self.shard = shard # (分片下标, 分片总数)，None表示批改全部学生
+            # 这里不打开数据库，建表等操作在ScoreLoader后台线程中进行，不阻塞窗口显示
+            self.store = ScoreStore(
+                os.path.join(self.output_dir, f"评分结果_{str(output_id)}.sqlite"),
+                self.grader,
+                lease_seconds=int(self.config.get("lease_seconds", 600)),
+            )
             
         except Exception as e:
             print(f"加载配置文件时出错: {str(e)}")
@@ -46,24 +174,177 @@ class GradingApp(QMainWindow):
         # 确保输出目录存在
         os.makedirs(self.output_dir, exist_ok=True)
         self.initUI()
-        self.load_existing_scores()
-        
+
         self.current_index = 0
-        self.notebook_files = self.get_notebook_files()
-        
+        self.notebook_files = []
+        self.scores_df = None
+        self.scores_rev = 0
+        self.current_output_text = ""
+        self.claimed_student_id = None
+        self._scanned_files = None
+        self.startup_complete = False
+
+        # 定时拉取其他助教的评分并续期当前学生的租约
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(int(float(self.config.get("refresh_interval", 5)) * 1000))
+        self.refresh_timer.timeout.connect(self._on_refresh_timer)
+        QApplication.instance().aboutToQuit.connect(self._release_leases)
+
+        # 保存后延迟导出xlsx：连续保存合并为一次，且在后台线程中写文件
+        self._export_pending = False
+        self.export_timer = QTimer(self)
+        self.export_timer.setSingleShot(True)
+        self.export_timer.setInterval(int(float(self.config.get("export_delay", 2)) * 1000))
+        self.export_timer.timeout.connect(self._start_export)
+        self.xlsx_exporter = XlsxExporter(self.store, self.output_file, self)
+        self.xlsx_exporter.finished.connect(self._on_export_finished)
+        self.xlsx_exporter.export_failed.connect(
+            lambda error: self.statusBar().showMessage(f"Error exporting scores to Excel: {error}", 5000))
+        QApplication.instance().aboutToQuit.connect(self._flush_export)
+
+        # 窗口先显示，目录扫描和评分读取放到后台线程进行
+        self._set_controls_enabled(False)
+        self._update_navigation_buttons_state()
+        self.code_display.setText(f"Scanning '{self.hw_dir}' ...")
+        self.statusBar().showMessage("Loading notebooks and existing scores...")
+
+        self.score_loader = ScoreLoader(self.store, self.output_file, self)
+        self.score_loader.scores_ready.connect(self._on_scores_ready)
+        self.notebook_scanner = NotebookScanner(self.hw_dir, self)
+        self.notebook_scanner.progress.connect(self._on_scan_progress)
+        self.notebook_scanner.files_ready.connect(self._on_files_ready)
+        self.score_loader.start()
+        self.notebook_scanner.start()
+
+    def _on_scan_progress(self, count):
+        self.code_display.setText(f"Scanning '{self.hw_dir}' ... {count} notebooks found")
+
+    def _on_files_ready(self, files):
+        if files is None:
+            self.statusBar().showMessage(f"'{self.hw_dir}' directory not found. Please create it and add notebooks.", 5000)
+            files = []
+        elif not files:
+            self.statusBar().showMessage(f"No .ipynb files found in '{self.hw_dir}'.", 3000)
+        elif self.shard is not None:
+            # 只保留属于本助教分片的学生
+            shard_index, num_shards = self.shard
+            files = [f for f in files if shard_of(self._extract_student_info(f)[1], num_shards) == shard_index]
+            self.student_nav_label.setText(f"Student: N/A | {len(files)} files in shard {shard_index}/{num_shards}")
+        else:
+            self.student_nav_label.setText(f"Student: N/A | {len(files)} files")
+        self._scanned_files = files
+        self._show_first_student()
+
+    def _on_scores_ready(self, scores_df, rev, error):
+        self.scores_df = scores_df
+        self.scores_rev = rev
+        if error is not None:
+            self.statusBar().showMessage(f"Error loading scores: {error}. Starting with empty scores.", 5000)
+        self._show_first_student()
+
+    def _show_first_student(self):
+        """文件列表和已有评分都就绪后，立即显示第一个未批阅的学生"""
+        if self.startup_complete or self._scanned_files is None or self.scores_df is None:
+            return
+        self.startup_complete = True
+        self.notebook_files = self._scanned_files
+
         if self.notebook_files:
             # 查找第一个未批阅的学生
             self.find_first_unreviewed_student()
-            self.load_notebook_by_index(self.current_index)
-            self._set_controls_enabled(True)
+            self.load_notebook_by_index(self.current_index) # 领取成功才会启用评分控件
             self._update_navigation_buttons_state()
+            self.refresh_timer.start()
         else:
             self.display_no_notebooks_state()
+
+        self._report_startup_time("first student")
+        if self.exit_after_load:
+            QTimer.singleShot(0, QApplication.instance().quit)
+
+    def _report_startup_time(self, stage):
+        if self.profile_startup:
+            print(f"[startup] {stage}: {time.perf_counter() - _IMPORT_T0:.3f}s", file=sys.stderr, flush=True)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self._first_paint_done:
+            self._first_paint_done = True
+            self._report_startup_time("first paint")
+    def _apply_score_rows(self, rows):
+        """把存储中变更的记录合并进本地scores_df"""
+        import pandas as pd
+        if not rows:
+            return
+        changed_df = pd.DataFrame(rows, columns=SCORE_COLUMNS)
+        self.scores_df = self.scores_df[~self.scores_df["学号"].isin(changed_df["学号"])]
+        self.scores_df = pd.concat([self.scores_df, changed_df], ignore_index=True)
+
+    def refresh_scores(self):
+        """增量拉取共享存储中自上次以来变更的评分，返回变更记录"""
+        rows, self.scores_rev = self.store.fetch_scores(self.scores_rev)
+        self._apply_score_rows(rows)
+        return rows
+
+    def _on_refresh_timer(self):
+        try:
+            rows = self.refresh_scores()
+            if self.claimed_student_id is not None:
+                self.store.renew(self.claimed_student_id)
+        except Exception as e:
+            self.statusBar().showMessage(f"Error refreshing shared scores: {e}", 3000)
+            return
+        if self.claimed_student_id is None and self.notebook_files:
+            # 所有学生都被占用时，等其他助教释放后再领取
+            self.load_notebook_by_index(self.current_index)
+        elif rows:
+            self.statusBar().showMessage(f"Synced {len(rows)} score(s) from other graders.", 2000)
+
+    def _release_leases(self):
+        self.refresh_timer.stop()
+        try:
+            self.store.release()
+        except Exception as e:
+            print(f"释放租约时出错: {str(e)}")
+        self.claimed_student_id = None
+
+    def _start_export(self):
+        if self.xlsx_exporter.isRunning():
+            return # 正在导出，结束后会根据_export_pending再导出一次
+        self._export_pending = False
+        self.xlsx_exporter.start()
+
+    def _on_export_finished(self):
+        if self._export_pending and not self.export_timer.isActive():
+            self._start_export()
+
+    def _flush_export(self):
+        """退出前把尚未导出的评分同步写入xlsx"""
+        self.export_timer.stop()
+        self.xlsx_exporter.wait()
+        if self._export_pending:
+            self._export_pending = False
+            try:
+                self.store.export_xlsx(self.output_file)
+            except Exception as e:
+                print(f"导出评分xlsx时出错: {str(e)}")
+
+    def _claim_from(self, index, step):
+        """从index开始沿step方向找到第一个能领取的学生，返回其下标；都被其他助教占用时返回None"""
+        while 0 <= index < len(self.notebook_files):
+            student_name, student_id = self._extract_student_info(self.notebook_files[index])
+            if self.store.claim(student_id) is None:
+                return index
+            index += step
+        return None
+
     def find_first_unreviewed_student(self):
         """查找第一个未批阅的学生并设置current_index"""
+        # 已批阅的以及正被其他助教批改的学生都跳过
+        skip_ids = set(self.scores_df["学号"].values) | self.store.held_by_others()
         for i, notebook_file in enumerate(self.notebook_files):
             student_name, student_id = self._extract_student_info(notebook_file)
-            if student_id not in self.scores_df["学号"].values:
+            if student_id not in skip_ids:
                 self.current_index = i
                 return
         # 如果所有学生都已批阅，保持current_index为0
@@ -100,11 +381,22 @@ class GradingApp(QMainWindow):
         # QTextEdit defaults to Expanding/Expanding.
 
         # Output Display (Middle)
-        self.output_display = QLabel("Output will be displayed here")
-        self.output_display.setAlignment(Qt.AlignCenter)
-        self.output_display.setWordWrap(True)
+        # 常驻的图片+文本视图，切换学生时原地更新，不再每次新建控件
+        self.output_display = QWidget()
+        output_layout = QVBoxLayout(self.output_display)
+        self.output_image_label = QLabel()
+        self.output_image_label.setAlignment(Qt.AlignCenter)
+        self.output_image_label.hide()
+        output_layout.addWidget(self.output_image_label)
+        self.output_text_label = QLabel("Output will be displayed here")
+        self.output_text_label.setWordWrap(True)
+        output_layout.addWidget(self.output_text_label)
         self.output_display.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred) # Good for image scaling
 
+        # 缩放后图片的LRU缓存，条目数有上限，来回翻看时无需重复解码
+        self.pixmap_cache = OrderedDict()
+        self.pixmap_cache_size = int(self.config.get("pixmap_cache_size", 8))
+
         # Right Panel for controls
         right_panel_widget = QWidget()
         right_panel_layout = QVBoxLayout(right_panel_widget) # Vertical layout for controls
@@ -168,7 +460,7 @@ class GradingApp(QMainWindow):
         self.comment_input.setEnabled(enabled)
         self.call_ai_button.setEnabled(enabled)
     def _update_navigation_buttons_state(self):
-        if not self.notebook_files:
+        if not self.notebook_files or self.claimed_student_id is None:
             self.previous_button.setEnabled(False)
             self.next_button.setEnabled(False)
             return
@@ -178,8 +470,7 @@ class GradingApp(QMainWindow):
 
     def display_no_notebooks_state(self):
         self.code_display.setText(f"No notebook files found in '{self.hw_dir}' folder or folder is missing.")
-        self.output_display.setText("")
-        self.output_display.setPixmap(QPixmap())
+        self._set_output("")
         self.setWindowTitle("CV Grading System - No Notebooks")
         self.student_nav_label.setText("Student: N/A")
         self.score_input.clear()
@@ -188,21 +479,52 @@ class GradingApp(QMainWindow):
         self._update_navigation_buttons_state() # Also update nav buttons
         self.statusBar().showMessage(f"No notebooks loaded. Please check the '{self.hw_dir}' folder.")
 
+    def display_all_claimed_state(self):
+        """没有能领取的学生（都在被其他助教批改）时禁用评分，刷新定时器会继续尝试领取"""
+        self.code_display.setText("All students are being graded by other graders. Waiting for one to become available ...")
+        self._set_output("")
+        self.setWindowTitle("CV Grading System - All Students Claimed")
+        self.student_nav_label.setText(f"Student: N/A | {len(self.notebook_files)} files")
+        self.score_input.clear()
+        self.comment_input.clear()
+        self._set_controls_enabled(False)
+        self._update_navigation_buttons_state()
+        self.statusBar().showMessage("All students are being graded by other graders.")
+
 
-    def load_existing_scores(self):
-        try:
-            if os.path.exists(self.output_file):
-                self.scores_df = pd.read_excel(self.output_file, dtype={"学号": str})  
-                # Ensure required columns exist
-                expected_cols = ["学号", "姓名", "分数", "评论"]
-                for col in expected_cols:
-                    if col not in self.scores_df.columns:
-                        self.scores_df[col] = "" # Add missing columns as empty strings or appropriate defaults
-            else:
-                self.scores_df = pd.DataFrame(columns=["学号", "姓名", "分数", "评论"])
-        except Exception as e:
-            self.scores_df = pd.DataFrame(columns=["学号", "姓名", "分数", "评论"])
-            self.statusBar().showMessage(f"Error loading scores: {e}. Starting with empty scores.", 5000)
+    def _set_output(self, text, pixmap=None):
+        """原地更新输出区域，先释放上一张图片再显示新的"""
+        self.output_image_label.clear()
+        if pixmap is not None and not pixmap.isNull():
+            self.output_image_label.setPixmap(pixmap)
+            self.output_image_label.show()
+        else:
+            self.output_image_label.hide()
+        self.output_text_label.setText(text)
+
+    def _get_output_pixmap(self, notebook_path, image_data):
+        """解码并缩放cell输出中的图片，结果放入有上限的LRU缓存"""
+        key = (notebook_path, hash(image_data))
+        if key in self.pixmap_cache:
+            self.pixmap_cache.move_to_end(key)
+            return self.pixmap_cache[key]
+
+        pixmap = QPixmap()
+        pixmap.loadFromData(base64.b64decode(image_data))
+        if pixmap.isNull():
+            return None
+        scaled_pixmap = pixmap.scaled(
+            1000, 
+            int(1000 * pixmap.height() / pixmap.width()),
+            Qt.KeepAspectRatio, 
+            Qt.SmoothTransformation
+        )
+        del pixmap # 原图不再需要，缩放后立即释放
+
+        self.pixmap_cache[key] = scaled_pixmap
+        while len(self.pixmap_cache) > self.pixmap_cache_size:
+            self.pixmap_cache.popitem(last=False)
+        return scaled_pixmap
 
 
     def _extract_student_info(self, notebook_file_path):
@@ -225,6 +547,15 @@ class GradingApp(QMainWindow):
                  student_name = parts[0]
                  student_id = parts[0]
         return student_name, str(student_id)
+    def _persist_score(self, student_id, student_name, score_text, comment):
+        """写入共享存储，同步本地scores_df，并安排导出xlsx供merge_score.py使用"""
+        if str(student_id) != self.claimed_student_id:
+            raise LeaseLostError(f"student {student_id} is not claimed by this instance")
+        self.store.upsert_score(student_id, student_name, score_text, comment)
+        self.refresh_scores()
+        self._export_pending = True
+        self.export_timer.start()
+
     def save_score_and_next(self): # Renamed method
         if not self.notebook_files or self.current_index >= len(self.notebook_files):
             self.statusBar().showMessage("No student selected or no notebooks loaded.")
@@ -246,31 +577,18 @@ class GradingApp(QMainWindow):
             self.statusBar().showMessage("Invalid score. Please enter a number.")
             return
 
-        existing_entry_mask = self.scores_df["学号"] == student_id
-        
-        if existing_entry_mask.any():
-            idx_to_update = self.scores_df[existing_entry_mask].index[0]
-            self.scores_df.loc[idx_to_update, "姓名"] = student_name
-            self.scores_df.loc[idx_to_update, "分数"] = score_text
-            self.scores_df.loc[idx_to_update, "评论"] = comment
+        if (self.scores_df["学号"] == student_id).any():
             action_message = f"Score updated for {student_name}."
         else:
-            new_row = pd.DataFrame([{
-                "学号": student_id, 
-                "姓名": student_name, 
-                "分数": score_text, 
-                "评论": comment
-            }])
-            self.scores_df = pd.concat([self.scores_df, new_row], ignore_index=True)
             action_message = f"Score saved for {student_name}."
         
         try:
-            self.scores_df.to_excel(self.output_file, index=False)
+            self._persist_score(student_id, student_name, score_text, comment)
             self.statusBar().showMessage(action_message)
             # Navigate to next student
             self.navigate_next(show_message_if_last=False) # Don't show "last student" message here
         except Exception as e:
-            self.statusBar().showMessage(f"Error saving scores to Excel: {e}")
+            self.statusBar().showMessage(f"Error saving scores: {e}")
 
 
 
@@ -280,6 +598,7 @@ class GradingApp(QMainWindow):
             self.statusBar().showMessage("No code to grade.")
             return
 
+        request_start = None # 请求发出后才记录日志；失败/超时的请求同样记录
         try:
             import openai
             from openai import OpenAI
@@ -288,29 +607,9 @@ class GradingApp(QMainWindow):
             with open(self.config_file_path, 'r', encoding='utf-8') as f:
                 config = yaml.safe_load(f)
                 system_prompt = config.get("system_prompt", "")
-                question = config.get("question", "")
-            
-                ai_input = config.get("ai_input", 1)  # 默认为1:仅代码
 
-            # 根据ai_input准备输入内容
-            # 准备输入内容
-            if ai_input == 1:  # 仅代码
-                input_content = f"{question}\n\n学生代码:\n{student_code}"
-            else:
-                # 获取输出文本内容
-                output_text = ""
-                if hasattr(self.output_display, 'text'):  # 如果是QLabel
-                    output_text = self.output_display.text()
-                elif isinstance(self.output_display, QWidget):  # 如果是QWidget容器
-                    # 查找容器中的QLabel
-                    for child in self.output_display.findChildren(QLabel):
-                        output_text = child.text()
-                        break
-                
-                if ai_input == 2:  # 仅输出文本
-                    input_content = f"{question}\n\n学生输出:\n{output_text}"
-                else:  # 代码和输出文本
-                    input_content = f"{question}\n\n学生代码:\n{student_code}\n\n学生输出:\n{output_text}"
+            # 根据ai_input准备输入内容：去注释/空行、截取作答区域，并按token预算分别裁剪代码和输出
+            input_content, prompt_stats = build_prompt(config, student_code, self.current_output_text)
             
             
             # 初始化客户端
@@ -323,6 +622,8 @@ class GradingApp(QMainWindow):
             
             # 流式请求
             full_response = ""
+            request_start = time.perf_counter()
+            first_token_latency = None
             stream = client.chat.completions.create(
                 model=config.get("model_name"),
                 messages=[
@@ -335,6 +636,8 @@ class GradingApp(QMainWindow):
             # 处理流式响应
             for chunk in stream:
                 if chunk.choices[0].delta.content:
+                    if first_token_latency is None:
+                        first_token_latency = time.perf_counter() - request_start
                     part = chunk.choices[0].delta.content
                     full_response += part
                     # 实时更新评论框
@@ -342,6 +645,9 @@ class GradingApp(QMainWindow):
                     self.comment_input.moveCursor(self.comment_input.textCursor().End)
                     self.comment_input.repaint()
                     QApplication.processEvents()  # 处理UI事件
+            total_latency = time.perf_counter() - request_start
+            request_start = None
+            self._log_ai_request(config, prompt_stats, first_token_latency, total_latency, full_response)
             
             # 根据AI输出自动评分
             first_10_chars = full_response[:10]
@@ -352,21 +658,37 @@ class GradingApp(QMainWindow):
                 self.score_input.setText("80")
                 self.save_current_score()
             
-            self.statusBar().showMessage("AI评估完成", 3000)
+            self.statusBar().showMessage(f"AI评估完成 (约{prompt_stats['prompt_tokens']} tokens, {total_latency:.1f}s)", 3000)
             
         except Exception as e:
+            if request_start is not None:
+                self._log_ai_request(config, prompt_stats, first_token_latency, time.perf_counter() - request_start,
+                                     full_response, error=f"{type(e).__name__}: {e}")
             self.comment_input.setPlainText(f"AI评估失败: {str(e)}")
             self.statusBar().showMessage(f"调用AI API出错: {str(e)}", 5000)
 
-    def get_notebook_files(self):
-        if not os.path.isdir(self.hw_dir):
-            self.statusBar().showMessage(f"'{self.hw_dir}' directory not found. Please create it and add notebooks.", 5000)
-            return []
-        
-        files = [os.path.join(self.hw_dir, f) for f in os.listdir(self.hw_dir) if f.endswith(".ipynb") and not f.startswith('.~lock.')] # Ignore lock files
-        if not files:
-            self.statusBar().showMessage(f"No .ipynb files found in '{self.hw_dir}'.", 3000)
-        return sorted(files) # Sort for consistent order
+    def _log_ai_request(self, config, prompt_stats, first_token_latency, total_latency, response, error=None):
+        """每次AI请求（包括超时、接口报错的请求）追加一行JSON日志，便于权衡token预算与速度/成本"""
+        student_id = None
+        if self.notebook_files and self.current_index < len(self.notebook_files):
+            student_id = self._extract_student_info(self.notebook_files[self.current_index])[1]
+        record = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "grader": self.grader,
+            "student_id": student_id,
+            "model": config.get("model_name"),
+            "ai_input": config.get("ai_input", 1),
+            **prompt_stats,
+            "first_token_latency": round(first_token_latency, 3) if first_token_latency is not None else None,
+            "total_latency": round(total_latency, 3),
+            "response_tokens": estimate_tokens(response),
+            "error": error,
+        }
+        try:
+            with open(self.ai_log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"写入AI请求日志时出错: {str(e)}")
 
     def load_notebook_by_index(self, index):
         if not self.notebook_files or not (0 <= index < len(self.notebook_files)):
@@ -378,6 +700,30 @@ class GradingApp(QMainWindow):
                 self.statusBar().showMessage("No more notebooks in this direction.")
             return
 
+        # 领取该学生的租约；若正被其他助教批改，则沿导航方向跳过
+        step = -1 if index < self.current_index else 1
+        try:
+            claimed_index = self._claim_from(index, step)
+        except Exception as e:
+            self.statusBar().showMessage(f"Error claiming student in shared store: {e}", 5000)
+            return
+        if claimed_index is None:
+            if self.claimed_student_id is None:
+                self.display_all_claimed_state()
+            else:
+                self.statusBar().showMessage("All students in this direction are being graded by other graders.")
+            return
+        index = claimed_index
+        claimed_id = self._extract_student_info(self.notebook_files[index])[1]
+        if self.claimed_student_id is not None and self.claimed_student_id != claimed_id:
+            try:
+                self.store.release(self.claimed_student_id)
+            except Exception as e:
+                # 释放失败不影响继续批改，旧租约到期后自然失效
+                self.statusBar().showMessage(f"Error releasing previous student in shared store: {e}", 5000)
+        self.claimed_student_id = claimed_id
+        self._set_controls_enabled(True)
+
         self.current_index = index # Ensure current_index is updated
         notebook_path = self.notebook_files[index]
         notebook_basename = os.path.basename(notebook_path)
@@ -386,15 +732,12 @@ class GradingApp(QMainWindow):
         student_name, student_id = self._extract_student_info(notebook_path)
         self.student_nav_label.setText(f"Student: {student_name} ({student_id}) | File {index+1}/{len(self.notebook_files)}")
 
+        import nbformat
+        import pandas as pd
+
         self.code_display.clear()
-        if hasattr(self.output_display, 'setText'):
-            self.output_display.setText("")
-            self.output_display.setPixmap(QPixmap())
-        else:
-            # If output_display is a QWidget, find and clear its QLabel children
-            for child in self.output_display.findChildren(QLabel):
-                child.setText("")
-                child.setPixmap(QPixmap())
+        self._set_output("")
+        self.current_output_text = "" # 未截断的输出文本，供AI评分使用
 
         try:
             with open(notebook_path, 'r', encoding='utf-8') as f:
@@ -412,7 +755,7 @@ class GradingApp(QMainWindow):
             all_code_cells = [cell['source'] for cell in notebook.cells if cell.cell_type == 'code']
             self.code_display.setText("\n\n# -------- New Cell --------\n\n".join(all_code_cells))
             # Optionally, display all outputs or first output of notebook here
-            self.output_display.setText("Target string not loaded. Outputs for specific cell cannot be isolated.")
+            self._set_output("Target string not loaded. Outputs for specific cell cannot be isolated.")
         else:
             for cell in notebook.cells:
                 if cell.cell_type == 'code' and self.target_string in cell['source']:
@@ -436,45 +779,22 @@ class GradingApp(QMainWindow):
                     
                     # 创建输出文本
                     output_text = "\n".join(text_outputs) if text_outputs else "No text output"
+                    self.current_output_text = output_text
                     output_text_size = len(output_text)
                     if output_text_size > 500:
                         output_text = f"(truncated {output_text_size - 500} characters)...\n" + output_text[output_text_size-500: output_text_size] 
                     
-                    # 创建新的widget来同时显示图片和文本
-                    output_widget = QWidget()
-                    output_layout = QVBoxLayout(output_widget)
-                    
-                    # 如果有图片，添加图片
+                    # 原地更新图片和文本
+                    scaled_pixmap = None
                     if found_image_data:
-                        pixmap = QPixmap()
-                        pixmap.loadFromData(base64.b64decode(found_image_data))
-                        if not pixmap.isNull():
-                            image_label = QLabel()
-                            scaled_pixmap = pixmap.scaled(
-                                1000, 
-                                int(1000 * pixmap.height() / pixmap.width()),
-                                Qt.KeepAspectRatio, 
-                                Qt.SmoothTransformation
-                            )
-                            image_label.setPixmap(scaled_pixmap)
-                            output_layout.addWidget(image_label)
-                    
-                    # 添加文本输出
-                    text_label = QLabel(output_text)
-                    text_label.setWordWrap(True)
-                    output_layout.addWidget(text_label)
-                    
-                    # 清空并设置新的输出widget
-                    self.output_display = output_widget
-                    container = self.centralWidget()
-                    container.layout().replaceWidget(container.layout().itemAt(1).widget(), self.output_display)
+                        scaled_pixmap = self._get_output_pixmap(notebook_path, found_image_data)
+                    self._set_output(output_text, scaled_pixmap)
                     
                     break # 找到第一个匹配的cell后停止
             
             if not target_cell_found:
                 self.code_display.setText(f"Target string '{self.target_string}' not found in any code cell of this notebook.")
-                self.output_display.setText("")
-                self.output_display.setPixmap(QPixmap())
+                self._set_output("")
 
 
         # Pre-fill score and comment if exists
@@ -522,26 +842,17 @@ class GradingApp(QMainWindow):
             self.statusBar().showMessage("Invalid score. Please enter a number.")
             return False
 
-        # 先删除所有该学生的记录
-        self.scores_df = self.scores_df[self.scores_df["学号"] != student_id]
-        
-        # 添加新记录
-        new_row = pd.DataFrame([{
-            "学号": str(student_id), 
-            "姓名": student_name, 
-            "分数": score_text, 
-            "评论": comment
-        }])
-        self.scores_df = pd.concat([self.scores_df, new_row], ignore_index=True)
-        
         try:
-            # 保存前再次去重（防御性编程）
-            self.scores_df.drop_duplicates(subset=["学号"], keep="last", inplace=True)
-            self.scores_df.to_excel(self.output_file, index=False)
+            # 按学号upsert，不会覆盖其他助教的评分
+            self._persist_score(str(student_id), student_name, score_text, comment)
             self.statusBar().showMessage(f"Score saved for {student_name}.")
             return True
+        except LeaseLostError:
+            self.statusBar().showMessage(
+                f"{student_name} is not claimed by this window (lease expired or taken by another grader); score not saved.")
+            return False
         except Exception as e:
-            self.statusBar().showMessage(f"Error saving scores to Excel: {e}")
+            self.statusBar().showMessage(f"Error saving scores: {e}")
             return False
 
     def navigate_next(self, show_message_if_last=True):
@@ -556,6 +867,12 @@ class GradingApp(QMainWindow):
             self.statusBar().showMessage("Already at the last student. Existing" ,3000)
             QTimer.singleShot(2000, QApplication.instance().quit)  # 2秒后退出程序
 
+    def closeEvent(self, event):
+        # 等待后台线程结束，避免QThread在运行中被销毁
+        self.score_loader.wait()
+        self.notebook_scanner.wait()
+        super().closeEvent(event)
+
     def keyPressEvent(self, event):
         if not self.notebook_files:
             super().keyPressEvent(event) # Pass to parent if no files to navigate
@@ -566,22 +883,19 @@ class GradingApp(QMainWindow):
 
         if key == Qt.Key_Q:  # Previous student
             if self.current_index > 0:
-                self.current_index -= 1
-                self.load_notebook_by_index(self.current_index)
+                self.load_notebook_by_index(self.current_index - 1)
             else:
                 self.statusBar().showMessage("Already at the first student.")
         elif key == Qt.Key_E:  # Next student
             if self.current_index < len(self.notebook_files) - 1:
-                self.current_index += 1
-                self.load_notebook_by_index(self.current_index)
+                self.load_notebook_by_index(self.current_index + 1)
             else:
                 self.statusBar().showMessage("Already at the last student.")
         elif key == Qt.Key_S:  # 给100分并切换到下一个同学
             self.score_input.setText("100")
             self.save_current_score()  # 先保存100分
             if self.current_index < len(self.notebook_files) - 1:
-                self.current_index += 1
-                self.load_notebook_by_index(self.current_index)
+                self.load_notebook_by_index(self.current_index + 1)
             else:
                 self.statusBar().showMessage("Already at the last student.")
         elif key == Qt.Key_A:  # 调用AI评估
@@ -593,9 +907,27 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", help="Path to config file", default=None)
+    parser.add_argument("--profile-startup", action="store_true", help="Print import / first paint / first student timings to stderr")
+    parser.add_argument("--exit-after-load", action="store_true", help="Quit as soon as the first student is displayed (for startup benchmarks)")
+    parser.add_argument("--grader", help="Grader name shown and recorded with scores (default: user@host); leases are per GUI instance", default=None)
+    parser.add_argument("--shard", help="Only grade students in shard i of n, e.g. 0/3", default=None)
     args = parser.parse_args()
+
+    shard = None
+    if args.shard:
+        try:
+            shard_index, num_shards = (int(x) for x in args.shard.split("/"))
+            if not 0 <= shard_index < num_shards:
+                raise ValueError
+        except ValueError:
+            print(f"错误：--shard 格式应为 i/n 且 0 <= i < n，当前为 {args.shard}")
+            sys.exit(1)
+        shard = (shard_index, num_shards)
     
     app = QApplication(sys.argv)
-    grading_app = GradingApp(config_path=args.config)
+    if args.profile_startup:
+        print(f"[startup] imports: {_IMPORT_SECONDS:.3f}s", file=sys.stderr, flush=True)
+    grading_app = GradingApp(config_path=args.config, profile_startup=args.profile_startup, exit_after_load=args.exit_after_load,
+                             grader=args.grader, shard=shard)
     grading_app.show()
     sys.exit(app.exec_())
\ No newline at end of file
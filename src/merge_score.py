@@ -6,6 +6,8 @@ Description: 合并多个作业的评分结果并计算加权平均分数
 
 import os
 import sys
+import time
+import importlib.util
 import pandas as pd
 import yaml
 from glob import glob
@@ -44,26 +46,28 @@ def merge_scores(configs):
             df = pd.read_excel(output_file, dtype={"学号": str})
             df = df[["学号", "姓名", "分数", "评论"]]  # 只保留需要的列
             
-            # 重命名分数和评论列，加上作业标识
-            df = df.rename(columns={
-                "分数": f"{config_name}_分数",
-                "评论": f"{config_name}_评论"
-            })
-            
-            # 添加权重列
-            weight = config.get("weight", 1.0)
-            df[f"{config_name}_权重"] = weight
-            
-            if merged_df is None:
-                merged_df = df
-            else:
-                merged_df = pd.merge(merged_df, df, on=["学号", "姓名"], how="outer")
+            merged_df = merge_question_scores(merged_df, config_name, df, config.get("weight", 1.0))
                 
         except Exception as e:
             print(f"Error processing {output_file}: {e}")
     
     return merged_df
 
+def merge_question_scores(merged_df, config_name, df, weight):
+    """把一道题的 [学号, 姓名, 分数, 评论] 合并进总表"""
+    # 重命名分数和评论列，加上作业标识
+    df = df.rename(columns={
+        "分数": f"{config_name}_分数",
+        "评论": f"{config_name}_评论"
+    })
+    
+    # 添加权重列
+    df[f"{config_name}_权重"] = weight
+    
+    if merged_df is None:
+        return df
+    return pd.merge(merged_df, df, on=["学号", "姓名"], how="outer")
+
 def calculate_final_scores(merged_df, configs):
     """计算加权平均分数和总评语"""
     if merged_df is None:
@@ -122,17 +126,82 @@ def save_final_scores(final_df, output_dir):
     except Exception as e:
         print(f"Error saving final scores: {e}")
 
+def assignment_name(config_dir):
+    """作业名默认取配置目录的上一级目录名，如 /extp6/ai_ta/hw8/configs -> hw8"""
+    return os.path.basename(os.path.dirname(os.path.abspath(config_dir)))
+
+def resolve_assignment_names(config_dirs, names=None):
+    """确定每个配置目录对应的作业名；名字重复时会互相删除仓库分区，因此直接报错退出"""
+    if names is not None and len(names) != len(config_dirs):
+        print(f"Error: --assignment-name got {len(names)} name(s) for {len(config_dirs)} config directories")
+        sys.exit(1)
+    names = names or [assignment_name(config_dir) for config_dir in config_dirs]
+
+    seen = {}
+    for config_dir, name in zip(config_dirs, names):
+        if not name or "/" in name or "=" in name:
+            print(f"Error: Invalid assignment name '{name}' for {config_dir}")
+            sys.exit(1)
+        if name in seen:
+            print(f"Error: {seen[name]} and {config_dir} both map to assignment '{name}'; "
+                  f"use --assignment-name to give each directory a distinct name")
+            sys.exit(1)
+        seen[name] = config_dir
+    return names
+
+def merge_into_warehouse(config_dirs, warehouse_dir, output_file=None, names=None):
+    """把多个作业目录的评分增量写入列式仓库，只重算有变化的作业，并导出学期总评"""
+    # pyarrow只在写Parquet时才被pandas导入，这里提前检查，避免被逐文件的异常处理吞掉
+    if importlib.util.find_spec("pyarrow") is None:
+        print("Error: --warehouse requires pyarrow (pip install pyarrow)")
+        sys.exit(1)
+    from score_warehouse import ScoreWarehouse
+
+    assignments = resolve_assignment_names(config_dirs, names)
+    start = time.perf_counter()
+    warehouse = ScoreWarehouse(warehouse_dir)
+    for config_dir, assignment in zip(config_dirs, assignments):
+        configs = load_configs(config_dir)
+        if not configs:
+            print(f"Warning: No valid config files found in {config_dir}")
+            continue
+        changed = warehouse.ingest(assignment, configs)
+        if changed or warehouse.read_totals(assignment) is None:
+            warehouse.refresh_totals(assignment)
+            print(f"{assignment}: updated {len(changed)} question(s): {', '.join(changed)}")
+        else:
+            print(f"{assignment}: unchanged")
+
+    output_file = output_file or os.path.join(warehouse_dir, "学期总评.xlsx")
+    report_df = warehouse.export_report(output_file)
+    if report_df is None:
+        print("No score files found to merge")
+        sys.exit(1)
+    print(f"Semester report ({len(report_df)} students) saved to: {output_file} in {time.perf_counter() - start:.2f}s")
+
 def main():
     parser = argparse.ArgumentParser(description='Merge multiple homework scores')
-    parser.add_argument('--config', help='Path to config directory', required=True)
+    parser.add_argument('--config', nargs='+', help='Path to config directory (several directories require --warehouse)', required=True)
+    parser.add_argument('--warehouse', help='Columnar score warehouse directory for semester-wide incremental merges', default=None)
+    parser.add_argument('--output', help='Semester report path when using --warehouse (default: <warehouse>/学期总评.xlsx)', default=None)
+    parser.add_argument('--assignment-name', nargs='+', help='Assignment name for each --config directory, in the same order '
+                        '(default: name of the directory above each config directory)', default=None)
     args = parser.parse_args()
     
-    if not os.path.isdir(args.config):
-        print(f"Error: Config directory not found: {args.config}")
+    for config_dir in args.config:
+        if not os.path.isdir(config_dir):
+            print(f"Error: Config directory not found: {config_dir}")
+            sys.exit(1)
+
+    if args.warehouse:
+        merge_into_warehouse(args.config, args.warehouse, args.output, args.assignment_name)
+        return
+    if len(args.config) > 1:
+        print("Error: Merging several config directories requires --warehouse")
         sys.exit(1)
     
     # 加载所有配置文件
-    configs = load_configs(args.config)
+    configs = load_configs(args.config[0])
     if not configs:
         print("No valid config files found")
         sys.exit(1)
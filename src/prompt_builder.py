@@ -0,0 +1,154 @@
+"""
+Description: 构建AI评分请求的prompt：去掉注释和空行、按标记截取与题目相关的代码，
+             并按配置的token预算分别裁剪代码和输出，减少请求的token数与延迟。
+"""
+
+import io
+import re
+import tokenize
+
+# 粗略的本地token估算：中日韩字符约1个token/字，英文单词和数字约4个字符1个token，其余符号各算1个
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+_SYMBOL_RE = re.compile(r"[^\sA-Za-z0-9_\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """不依赖远端接口的token数估算，用于预算控制和日志"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    words = sum((len(word) + 3) // 4 for word in _WORD_RE.findall(text))
+    symbols = len(_SYMBOL_RE.findall(text))
+    return cjk + words + symbols
+
+
+def strip_comments(code):
+    """去掉注释和空行；缩进错误、魔法命令等导致无法分词时，退化为逐字符扫描去注释"""
+    lines = code.splitlines()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.COMMENT:
+                row, col = token.start
+                lines[row - 1] = lines[row - 1][:col]
+    except (tokenize.TokenError, SyntaxError):
+        lines = _strip_comments_by_scan(code.splitlines())
+    return "\n".join(line.rstrip() for line in lines if line.strip())
+
+
+def _strip_comments_by_scan(lines):
+    """不依赖分词的注释去除：跟踪引号（含跨行的三引号字符串），只截掉字符串之外的#及其后内容。
+    不识别f-string中嵌套同种引号等少见写法，遇到时该行的注释判断可能出错"""
+    result = []
+    quote = None # 当前所在字符串的定界符
+    for line in lines:
+        i, cut = 0, len(line)
+        while i < len(line):
+            if quote is not None:
+                if line[i] == "\\":
+                    i += 2
+                    continue
+                if line.startswith(quote, i):
+                    i += len(quote)
+                    quote = None
+                    continue
+            elif line[i] == "#":
+                cut = i
+                break
+            elif line[i] in "'\"":
+                quote = line[i] * 3 if line.startswith(line[i] * 3, i) else line[i]
+                i += len(quote)
+                continue
+            i += 1
+        if quote is not None and len(quote) == 1:
+            quote = None # 单引号字符串不跨行
+        result.append(line[:cut])
+    return result
+
+
+def extract_region(code, start_marker=None, end_marker=None):
+    """只保留start_marker所在行之后、end_marker所在行之前的代码（如模板中的作答区域）；
+    找不到标记时返回原代码"""
+    lines = code.splitlines()
+    start, end = 0, len(lines)
+    if start_marker:
+        for i, line in enumerate(lines):
+            if start_marker in line:
+                start = i + 1
+                break
+    if end_marker:
+        for i in range(start, len(lines)):
+            if end_marker in lines[i]:
+                end = i
+                break
+    region = lines[start:end]
+    return "\n".join(region) if any(line.strip() for line in region) else code
+
+
+def truncate_to_budget(text, budget, keep="head"):
+    """按行裁剪到token预算以内；keep="head"保留开头（代码），keep="tail"保留结尾（输出，报错和最终结果通常在最后）。
+    边界上放不下的那一行（如打印出的长列表/数组）会在剩余预算内按字符截取，而不是整行丢弃"""
+    if budget is None or estimate_tokens(text) <= budget:
+        return text
+    lines = text.splitlines()
+    if keep == "tail":
+        lines = lines[::-1]
+    kept, used = [], estimate_tokens("...(省略后0000行)…") # 为省略提示预留
+    partial = ""
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            partial = _truncate_line(line, budget - used - 1, keep)
+            break
+        kept.append(line)
+        used += cost
+    omitted = len(lines) - len(kept) - (1 if partial else 0)
+    if keep == "tail":
+        kept = kept[::-1]
+        if partial:
+            kept.insert(0, "…" + partial)
+        return "\n".join(([f"...(省略前{omitted}行)"] if omitted else []) + kept)
+    if partial:
+        kept.append(partial + "…")
+    return "\n".join(kept + ([f"...(省略后{omitted}行)"] if omitted else []))
+
+
+def _truncate_line(line, budget, keep):
+    """在一行内按字符截取到预算以内（二分查找能保留的最长前缀/后缀）"""
+    low, high = 0, len(line)
+    while low < high:
+        mid = (low + high + 1) // 2
+        part = line[len(line) - mid:] if keep == "tail" else line[:mid]
+        if estimate_tokens(part) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return line[len(line) - low:] if keep == "tail" else line[:low]
+
+
+def build_prompt(config, code, output_text):
+    """根据配置组装用户消息，返回 (prompt, 统计信息)"""
+    question = config.get("question", "")
+    ai_input = config.get("ai_input", 1)  # 默认为1:仅代码
+
+    code = extract_region(code, config.get("ai_code_start"), config.get("ai_code_end"))
+    if config.get("ai_strip_comments", True):
+        code = strip_comments(code)
+    code = truncate_to_budget(code, config.get("ai_code_token_budget", 2000), keep="head")
+    output_text = truncate_to_budget(output_text, config.get("ai_output_token_budget", 500), keep="tail")
+
+    if ai_input == 1:  # 仅代码
+        prompt = f"{question}\n\n学生代码:\n{code}"
+        output_text = ""
+    elif ai_input == 2:  # 仅输出文本
+        prompt = f"{question}\n\n学生输出:\n{output_text}"
+        code = ""
+    else:  # 代码和输出文本
+        prompt = f"{question}\n\n学生代码:\n{code}\n\n学生输出:\n{output_text}"
+
+    stats = {
+        "code_tokens": estimate_tokens(code),
+        "output_tokens": estimate_tokens(output_text),
+        "prompt_tokens": estimate_tokens(config.get("system_prompt", "")) + estimate_tokens(prompt),
+    }
+    return prompt, stats
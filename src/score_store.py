@@ -0,0 +1,250 @@
+"""
+Description: 多助教共享的评分存储（SQLite）。按学生逐条upsert，避免多个GUI实例互相覆盖；
+             通过租约(lease)保证同一学生同一时间只被一位助教打开；
+             每次写入后把全量结果原子地导出为 评分结果_{id}.xlsx，供 merge_score.py 使用。
+
+注意：数据库使用回滚日志(DELETE)模式而不是WAL，因为WAL依赖单机共享内存，不能跨机器使用。
+      多台机器共享时，outputs_path 所在的NFS必须支持POSIX(fcntl)锁（NFSv4，或启用了lockd的NFSv3），
+      否则并发写入可能损坏数据库；无法确认时，请让所有助教在同一台机器上运行GUI。
+"""
+
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import zlib
+
+SCORE_COLUMNS = ["学号", "姓名", "分数", "评论"]
+
+
+class LeaseLostError(Exception):
+    """当前实例没有（或已失去）该学生的租约，不能写入其评分"""
+
+
+def shard_of(student_id, num_shards):
+    """按学号稳定地分配分片，各助教只批改属于自己分片的学生"""
+    return zlib.crc32(str(student_id).encode("utf-8")) % num_shards
+
+
+class ScoreStore:
+    """构造时不访问数据库；使用前需调用一次 init_db()（可能因NFS或等待其他助教的写锁而较慢，GUI中在后台线程调用）"""
+
+    def __init__(self, db_path, grader, lease_seconds=600):
+        self.db_path = db_path
+        self.grader = grader # 仅用于显示和记录是谁打的分
+        # 租约归属于每个GUI实例：多位助教共用同一账号/同一台机器时也不会互相放行或误删租约
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.lease_seconds = lease_seconds
+
+    def _connect(self):
+        # 每次操作单独建立连接，GUI主线程与后台线程都可安全使用
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def init_db(self):
+        conn = self._connect()
+        try:
+            # WAL需要单机共享内存，不适用于网络文件系统
+            conn.execute("PRAGMA journal_mode = DELETE")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scores (
+                    student_id TEXT PRIMARY KEY,
+                    name TEXT,
+                    score TEXT,
+                    comment TEXT,
+                    grader TEXT,
+                    rev INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            lease_cols = [row[1] for row in conn.execute("PRAGMA table_info(leases)")]
+            if lease_cols and "owner" not in lease_cols:
+                # 旧版租约表没有实例标识；租约本身是临时数据，直接重建
+                conn.execute("DROP TABLE leases")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    student_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    grader TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS scores_rev ON scores(rev)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        finally:
+            conn.close()
+
+    def is_empty(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0] == 0
+        finally:
+            conn.close()
+
+    def import_rows(self, rows):
+        """导入 (学号, 姓名, 分数, 评论) 记录，用于从旧的xlsx迁移；已存在的学号不覆盖"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rev = self._next_rev(conn)
+            now = time.time()
+            conn.executemany(
+                "INSERT OR IGNORE INTO scores (student_id, name, score, comment, grader, rev, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(str(sid), name, score, comment, self.grader, rev, now) for sid, name, score, comment in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction: # BEGIN IMMEDIATE等锁超时时并没有开启事务
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _next_rev(conn):
+        # 单调递增的版本号，其他实例据此增量刷新，不依赖各机器时钟
+        current = conn.execute("SELECT COALESCE(MAX(rev), 0) FROM scores").fetchone()[0]
+        return current + 1
+
+    def upsert_score(self, student_id, name, score, comment):
+        """写入一条评分；要求当前实例持有该学生的租约（在同一事务内检查，租约过期后被他人领取也能发现）"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            held = conn.execute(
+                "SELECT 1 FROM leases WHERE student_id = ? AND owner = ?", (str(student_id), self.owner)
+            ).fetchone()
+            if held is None:
+                raise LeaseLostError(f"student {student_id} is not claimed by this instance")
+            rev = self._next_rev(conn)
+            conn.execute(
+                "INSERT INTO scores (student_id, name, score, comment, grader, rev, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(student_id) DO UPDATE SET name = excluded.name, score = excluded.score, "
+                "comment = excluded.comment, grader = excluded.grader, rev = excluded.rev, "
+                "updated_at = excluded.updated_at",
+                (str(student_id), name, score, comment, self.grader, rev, time.time()),
+            )
+            conn.execute("COMMIT")
+            return rev
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def fetch_scores(self, since_rev=0):
+        """返回 (rev之后变更的记录列表, 当前最大rev)，每条记录为 (学号, 姓名, 分数, 评论)"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT student_id, name, score, comment, rev FROM scores WHERE rev > ? ORDER BY rev",
+                (since_rev,),
+            ).fetchall()
+        finally:
+            conn.close()
+        max_rev = max((row[4] for row in rows), default=since_rev)
+        return [row[:4] for row in rows], max_rev
+
+    def claim(self, student_id):
+        """尝试为当前实例获取学生的租约；被其他实例持有且未过期时返回持有者的助教名，成功返回None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, grader, expires_at FROM leases WHERE student_id = ?", (str(student_id),)
+            ).fetchone()
+            if row is not None and row[0] != self.owner and row[2] > now:
+                conn.execute("ROLLBACK")
+                return row[1]
+            conn.execute(
+                "INSERT INTO leases (student_id, owner, grader, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(student_id) DO UPDATE SET owner = excluded.owner, grader = excluded.grader, "
+                "expires_at = excluded.expires_at",
+                (str(student_id), self.owner, self.grader, now + self.lease_seconds),
+            )
+            conn.execute("COMMIT")
+            return None
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def held_by_others(self):
+        """其他实例当前持有（未过期）的学号集合"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT student_id FROM leases WHERE owner != ? AND expires_at > ?",
+                (self.owner, time.time()),
+            ).fetchall()
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
+
+    def renew(self, student_id):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE student_id = ? AND owner = ?",
+                (time.time() + self.lease_seconds, str(student_id), self.owner),
+            )
+        finally:
+            conn.close()
+
+    def release(self, student_id=None):
+        """释放当前实例的租约；不指定学号时释放本实例持有的全部租约"""
+        conn = self._connect()
+        try:
+            if student_id is None:
+                conn.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+            else:
+                conn.execute(
+                    "DELETE FROM leases WHERE student_id = ? AND owner = ?", (str(student_id), self.owner)
+                )
+        finally:
+            conn.close()
+
+    def export_xlsx(self, output_file):
+        """把全部评分导出为xlsx，返回是否替换了文件。
+        写xlsx期间不持有数据库锁，只在替换文件时短暂加锁比较rev，较旧的快照不会覆盖较新的导出。"""
+        import pandas as pd
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT student_id, name, score, comment, rev FROM scores ORDER BY rev").fetchall()
+        finally:
+            conn.close()
+        snapshot_rev = max((row[4] for row in rows), default=0)
+
+        tmp_file = f"{output_file}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp.xlsx"
+        try:
+            pd.DataFrame([row[:4] for row in rows], columns=SCORE_COLUMNS).to_excel(tmp_file, index=False)
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT value FROM meta WHERE key = 'exported_rev'").fetchone()
+                if row is not None and row[0] >= snapshot_rev and os.path.exists(output_file):
+                    conn.execute("ROLLBACK")
+                    return False
+                os.replace(tmp_file, output_file)
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('exported_rev', ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (snapshot_rev,),
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
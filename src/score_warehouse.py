@@ -0,0 +1,202 @@
+"""
+Description: 学期范围的列式评分仓库（Parquet，需要pyarrow）。
+             每道题的评分记录按 assignment=<作业>/question=<题目> 分区存放，
+             合并时只重写源xlsx有变化的分区，并只重新计算受影响作业的加权总分，
+             最后从各作业总分分区导出学期总评。
+
+目录结构示例：
+    warehouse/
+    ├── manifest.json                      # 各分区对应源文件的指纹
+    ├── records/assignment=hw8/question=hw1/part-0.parquet
+    └── totals/assignment=hw8/part-0.parquet
+"""
+
+import os
+import json
+import shutil
+import pandas as pd
+
+from merge_score import merge_question_scores, calculate_final_scores
+
+RECORD_COLUMNS = ["学号", "姓名", "分数", "评论", "权重", "target"]
+
+
+class ScoreWarehouse:
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        os.makedirs(root, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _records_dir(self, assignment, question=None):
+        path = os.path.join(self.root, "records", f"assignment={assignment}")
+        if question is not None:
+            path = os.path.join(path, f"question={question}")
+        return path
+
+    def _totals_dir(self, assignment):
+        return os.path.join(self.root, "totals", f"assignment={assignment}")
+
+    @staticmethod
+    def _write_partition(df, partition_dir):
+        """写入单个分区；先写临时文件再替换"""
+        os.makedirs(partition_dir, exist_ok=True)
+        part_file = os.path.join(partition_dir, "part-0.parquet")
+        tmp_file = f"{part_file}.tmp"
+        df.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, part_file)
+
+    @staticmethod
+    def _read_partition(partition_dir):
+        part_file = os.path.join(partition_dir, "part-0.parquet")
+        if not os.path.exists(part_file):
+            return None
+        return pd.read_parquet(part_file)
+
+    @staticmethod
+    def _source_fingerprint(score_file, config):
+        stat = os.stat(score_file)
+        return {
+            "source": os.path.abspath(score_file),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "weight": config.get("weight", 1.0),
+            "target": config.get("target"),
+        }
+
+    def _drop_question(self, assignment, question):
+        """删除一道题的分区和清单记录，返回之前是否存在"""
+        shutil.rmtree(self._records_dir(assignment, question), ignore_errors=True)
+        return self.manifest.pop(f"{assignment}/{question}", None) is not None
+
+    def ingest(self, assignment, configs):
+        """把一个作业目录下各题的评分写入仓库，返回内容有变化的题目列表。
+        与merge_score.py一致，评分文件缺失或无法读取的题目不计入，之前写入的分区也会删除"""
+        changed = []
+        for config_name, config in configs.items():
+            output_dir = config.get("outputs_path", "")
+            score_file = os.path.join(output_dir, f"评分结果_{config.get('output_id', '')}.xlsx")
+            if not os.path.exists(score_file):
+                print(f"Warning: Score file not found for {config_name}: {score_file}")
+                if self._drop_question(assignment, config_name):
+                    print(f"Warning: Removed previously merged scores of {assignment}/{config_name}")
+                    changed.append(config_name)
+                continue
+
+            key = f"{assignment}/{config_name}"
+            fingerprint = self._source_fingerprint(score_file, config)
+            if self.manifest.get(key) == fingerprint:
+                continue
+
+            try:
+                df = pd.read_excel(score_file, dtype={"学号": str})
+                df = df[["学号", "姓名", "分数", "评论"]].copy()
+                df["姓名"] = df["姓名"].astype("string")
+                df["分数"] = pd.to_numeric(df["分数"], errors="coerce")
+                df["评论"] = df["评论"].astype("string")
+                df["权重"] = float(fingerprint["weight"])
+                df["target"] = fingerprint["target"] if fingerprint["target"] is not None else config_name
+                self._write_partition(df[RECORD_COLUMNS], self._records_dir(assignment, config_name))
+            except Exception as e:
+                print(f"Error processing {score_file}: {e}")
+                if self._drop_question(assignment, config_name):
+                    print(f"Warning: Removed previously merged scores of {assignment}/{config_name}")
+                    changed.append(config_name)
+                continue
+            self.manifest[key] = fingerprint
+            changed.append(config_name)
+
+        # 配置目录中已删除的题目，同时删除其分区
+        for question in self.questions(assignment):
+            if question not in configs:
+                self._drop_question(assignment, question)
+                changed.append(question)
+
+        self._save_manifest()
+        return changed
+
+    def questions(self, assignment):
+        prefix = f"{assignment}/"
+        return sorted(k[len(prefix):] for k in self.manifest if k.startswith(prefix))
+
+    def assignments(self):
+        return sorted({k.split("/", 1)[0] for k in self.manifest})
+
+    def refresh_totals(self, assignment):
+        """重新计算一个作业的加权总分与评语，写入totals分区。
+        分数/评语与merge_score.py一致（缺任一题时分数为空）；另存"计分"列，缺交的题目按0分计，供学期总评使用"""
+        merged_df = None
+        configs = {}
+        weights = {}
+        for question in self.questions(assignment):
+            df = self._read_partition(self._records_dir(assignment, question))
+            if df is None:
+                continue
+            weight = df["权重"].iloc[0] if not df.empty else 1.0
+            configs[question] = {"target": df["target"].iloc[0] if not df.empty else question}
+            weights[question] = float(weight)
+            merged_df = merge_question_scores(merged_df, question, df[["学号", "姓名", "分数", "评论"]], weight)
+
+        totals_dir = self._totals_dir(assignment)
+        if merged_df is None:
+            shutil.rmtree(totals_dir, ignore_errors=True)
+            return None
+        counted = sum(
+            merged_df[f"{question}_分数"].astype(float).fillna(0) * weight for question, weight in weights.items()
+        ) / sum(weights.values())
+        final_df = calculate_final_scores(merged_df, configs)
+        final_df = final_df.assign(计分=counted)
+        self._write_partition(final_df, totals_dir)
+        return final_df
+
+    def read_totals(self, assignment):
+        return self._read_partition(self._totals_dir(assignment))
+
+    def export_report(self, output_file):
+        """导出学期总评：每个作业一列分数（缺交的题目按0分计，整个作业缺交记0分），
+        学期分数为各作业分数的平均（各作业等权）"""
+        report_df = None
+        score_cols = []
+        comment_cols = []
+        for assignment in self.assignments():
+            totals_df = self.read_totals(assignment)
+            if totals_df is not None and "计分" not in totals_df.columns:
+                totals_df = self.refresh_totals(assignment) # 旧版本写入的分区没有计分列
+            if totals_df is None:
+                continue
+            totals_df = totals_df[["学号", "姓名", "计分", "评语"]].rename(
+                columns={"计分": f"{assignment}_分数", "评语": f"{assignment}_评语"})
+            score_cols.append(f"{assignment}_分数")
+            comment_cols.append(f"{assignment}_评语")
+            if report_df is None:
+                report_df = totals_df
+            else:
+                report_df = pd.merge(report_df, totals_df, on=["学号", "姓名"], how="outer")
+
+        if report_df is None:
+            return None
+
+        # 缺交整个作业的学生在该作业记0分，不能因为缺交而拉高平均分
+        report_df[score_cols] = report_df[score_cols].fillna(0)
+        report_df["分数"] = report_df[score_cols].mean(axis=1)
+        report_df["评语"] = report_df[comment_cols].apply(
+            lambda row: ",".join(
+                f"{{{col[:-len('_评语')]}:{value}}}" for col, value in row.items() if pd.notna(value)
+            ),
+            axis=1,
+        )
+        report_df = report_df[["学号", "姓名"] + score_cols + ["分数", "评语"]].sort_values("学号")
+        report_df.to_excel(output_file, index=False)
+        return report_df